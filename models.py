@@ -1,25 +1,267 @@
 import os
+import re
+import sys
+import tempfile
+import functools
+import importlib.util
 import traceback
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
-from time import perf_counter
-from sqlalchemy.exc import SQLAlchemyError
+from time import perf_counter, sleep
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
 import numpy as np
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.dialects.postgresql import JSON
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, text, Boolean, ForeignKey,func, TIMESTAMP,BigInteger, JSON
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, text, Boolean, ForeignKey,func, TIMESTAMP,BigInteger, JSON, MetaData, Table
 import json
 from sqlalchemy.orm import sessionmaker
 
+# Frames read from the database keep their data in Arrow buffers instead of object columns, when pyarrow is installed
+DTYPE_BACKEND = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'numpy_nullable'
+
 load_dotenv()
 
 Base = declarative_base()
 
 db = SQLAlchemy()
+
+# Matches every character that str.isalnum() rejects, used to normalise column names.
+_NON_ALNUM = re.compile(r'[\W_]+')
+
+
+# Matches pyformat placeholders, %(name)s
+_PYFORMAT_PARAM = re.compile(r'%\((\w+)\)s')
+
+
+@functools.lru_cache(maxsize=256)
+def _prepare(query):
+    """
+    Returns the query as a text() clause, with pyformat placeholders (%(name)s) rewritten into
+    the :name bound parameters used by SQLAlchemy. Cached, so repeated queries are prepared once.
+    """
+    return text(_PYFORMAT_PARAM.sub(r':\1', query))
+
+
+@functools.lru_cache(maxsize=4096)
+def _norm_col(column):
+    """
+    Returns the column name with every non alphanumeric character removed.
+    """
+    return _NON_ALNUM.sub('', column)
+
+
+# Above this many rows insert_data bulk loads through LOAD DATA LOCAL INFILE instead of executemany.
+LOAD_DATA_THRESHOLD = 500000
+
+# MySQL deadlock (1213) and lock wait timeout (1205) errors, a batch hitting one is retried.
+DEADLOCK_ERRORS = (1213, 1205)
+DEADLOCK_RETRIES = 3
+
+# Connections per engine pool, sized as (cores * 2) + 1.
+POOL_SIZE = ((os.cpu_count() or 1) * 2) + 1
+
+
+@functools.lru_cache(maxsize=8)
+def _engine_for(uri, local_infile=False):
+    """
+    Returns one shared engine (and connection pool) per database URI.
+
+    LOCAL INFILE lets the server ask the client for files, so it is only enabled on the separate
+    engine requested with local_infile=True, used by the LOAD DATA bulk path.
+
+    executemany_mode is a psycopg2 only option. For pymysql the fast path is already on: without
+    RETURNING, SQLAlchemy hands the rows to cursor.executemany(), which rewrites the INSERT into
+    multi-row VALUES statements of at most max_stmt_length bytes each.
+    """
+    engine = create_engine(uri,
+                           pool_size=POOL_SIZE,
+                           max_overflow=0,
+                           pool_pre_ping=True,
+                           pool_recycle=1800,
+                           connect_args={"local_infile": True} if local_infile else {},
+                           future=True)
+
+    # The compiled upsert is only reused across batches when the dialect caches statements
+    if not engine.dialect.supports_statement_cache:
+        print(f"Statement cache is disabled for dialect {engine.dialect.name}, statements will be recompiled per call")
+    return engine
+
+
+def _replace_nulls(data):
+    """
+    Returns a copy of the DataFrame with NaN/NaT/NA/None replaced by None, in a single pass per column.
+
+    >>> _replace_nulls(pd.DataFrame({'ts': pd.to_datetime(['2024-01-01', None])}))['ts'].tolist()
+    [Timestamp('2024-01-01 00:00:00'), None]
+    >>> _replace_nulls(pd.DataFrame({'n': pd.array([1, None], dtype='Int64')}))['n'].tolist()
+    [1, None]
+    """
+    # numpy integer and bool columns can't hold nulls and columns without nulls keep their dtype.
+    # Nullable extension dtypes (Int64, boolean, int64[pyarrow]) also have kind 'i'/'b' but can hold NA.
+    cleaned = {}
+    nulled = {}
+    for col, series in data.items():
+        if not (isinstance(series.dtype, np.dtype) and series.dtype.kind in 'iub'):
+            mask = series.isna().to_numpy()
+            if mask.any():
+                values = series.astype(object).to_numpy(copy=True)
+                values[mask] = None
+                nulled[col] = values
+                continue
+        cleaned[col] = series.array
+
+    # Object arrays are assigned after construction, so pandas can't infer them back to datetime64 (NaT)
+    cleaned_data = pd.DataFrame(cleaned, index=data.index)
+    for col, values in nulled.items():
+        cleaned_data[col] = pd.Series(values, index=data.index, dtype=object)
+    return cleaned_data[data.columns]
+
+
+def _intern_positions(df):
+    """
+    Returns the positions of the low cardinality string columns, whose values are worth interning.
+
+    Decided once per frame. Object columns holding unhashable values (dicts, lists) are skipped.
+    """
+    positions = set()
+    for j in range(df.shape[1]):
+        series = df.iloc[:, j]
+        if series.dtype != object:
+            continue
+        try:
+            if series.nunique() < len(series) // 4:
+                positions.add(j)
+        except TypeError:
+            continue
+    return positions
+
+
+def _iter_records(df, interned=None):
+    """
+    Yields the rows of the DataFrame as dicts, built from one native python list per column.
+
+    Column names are interned so every row dict shares the same key objects, and so do the
+    values of the low cardinality string columns at the `interned` positions.
+    """
+    if interned is None:
+        interned = _intern_positions(df)
+
+    columns = [sys.intern(c) if isinstance(c, str) else c for c in df.columns.tolist()]
+    values = []
+    for j in range(len(columns)):
+        column_values = df.iloc[:, j].tolist()
+        if j in interned:
+            column_values = [sys.intern(v) if type(v) is str else v for v in column_values]
+        values.append(column_values)
+
+    for row in zip(*values):
+        yield dict(zip(columns, row))
+
+
+def _iter_batches(df, size):
+    """
+    Yields lists of at most `size` row dicts. Each batch is converted from its own slice of the
+    DataFrame, so only one batch of python objects is alive at a time.
+    """
+    interned = _intern_positions(df)
+    for start in range(0, len(df), size):
+        yield list(_iter_records(df.iloc[start:start + size], interned))
+
+
+
+def _declare_table(table_name, columns):
+    """
+    Declares the target table, with a schema qualified name (schema.table) split into schema and table.
+    """
+    schema, _, name = table_name.rpartition('.')
+    return Table(name, MetaData(), *columns, schema=schema or None)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_upsert(table_name, columns):
+    """
+    Builds the INSERT ... ON DUPLICATE KEY UPDATE statement for the given table and columns.
+
+    The target table is declared so the statement compiles to a plain VALUES clause that pymysql's
+    executemany can rewrite into multi-row VALUES.
+    Columns keep their real names but are keyed by the normalised name used in the rows.
+    """
+    normalised_cloumns = [_norm_col(c) for c in columns]
+    table_columns = [Column(col, key=key) for col, key in zip(columns, normalised_cloumns)]
+    # record_updated is only declared when the frame doesn't already carry it, matched on the raw name
+    if 'record_updated' not in columns:
+        table_columns.append(Column('record_updated'))
+    table = _declare_table(table_name, table_columns)
+
+    stmt = insert(table)
+    update_values = {c.key: stmt.inserted[c.key] for c in table.c if c.name != 'record_updated'}
+    record_updated = next(c for c in table.c if c.name == 'record_updated')
+    update_values[record_updated.key] = func.current_timestamp()
+    return stmt.on_duplicate_key_update(update_values)
+
+
+def _quote_identifier(name):
+    """
+    Backtick quotes a column name as a single identifier, doubling any embedded backticks.
+    """
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _quote_table(name):
+    """
+    Backtick quotes a table name, quoting each part of a schema qualified name (schema.table).
+    """
+    return ".".join([_quote_identifier(part) for part in name.split(".")])
+
+
+@functools.lru_cache(maxsize=128)
+def _build_bulk_merge_sql(table_name, columns):
+    """
+    Builds the identifiers and the staging merge statement used by the LOAD DATA bulk path, once
+    per (table, columns).
+
+    Returns the quoted target table, the quoted staging table, the quoted column list and the
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE merge statement. Staged rows are merged in file
+    order, so a key repeated in the frame keeps its last row, as the executemany upsert does.
+    """
+    target_table = _quote_table(table_name)
+    staging_table = _quote_table(f"{table_name}_stg")
+    column_list = ", ".join([_quote_identifier(col) for col in columns])
+    update_string = ",".join([f"{_quote_identifier(col)} = values({_quote_identifier(col)})" for col in columns])
+    update_string = update_string + ",`record_updated` = current_timestamp()"
+
+    merge_sql = f"""
+        INSERT INTO {target_table} ({column_list})
+        SELECT {column_list} FROM {staging_table} ORDER BY `_stg_row`
+        ON DUPLICATE KEY UPDATE {update_string};
+    """
+    return target_table, staging_table, column_list, merge_sql
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_insert(table_name, columns, primary_key=None):
+    """
+    Builds the INSERT statement used by insert_df_table. With a primary key it becomes an
+    INSERT ... ON DUPLICATE KEY UPDATE of every other column.
+    """
+    table_columns = [Column(col) for col in columns]
+    # record_updated is only declared when the frame doesn't already carry it
+    if 'record_updated' not in columns:
+        table_columns.append(Column('record_updated'))
+    table = _declare_table(table_name, table_columns)
+
+    stmt = insert(table)
+    if primary_key:
+        update_values = {col: stmt.inserted[col] for col in columns if col != primary_key}
+        update_values['record_updated'] = func.current_timestamp()
+        stmt = stmt.on_duplicate_key_update(update_values)
+    return stmt
+
     
 class RawDatabase:
     """
@@ -51,6 +293,8 @@ class RawDatabase:
                                                                     os.getenv(f'_HOST'),
                                                                     os.getenv(f'_port'),
                                                                     os.getenv(f'_DB'))
+
+        self._engine = self.get_db_engine()
             
             
     def create_database_uri(self, user, password, host, port, database):
@@ -58,9 +302,9 @@ class RawDatabase:
 
     def get_db_engine(self, source=None):
         try:
-            database_uri = self.database_uris
-            engine = create_engine(database_uri)
-            return engine
+            if getattr(self, '_engine', None) is not None:
+                return self._engine
+            return _engine_for(self.database_uris)
         except Exception as e:
             print(traceback.format_exc(), str(e))
     
@@ -71,13 +315,15 @@ class RawDatabase:
             params = kwargs.get("params", {})
             source = kwargs.get("source", None)
 
-            query = query.replace("%(", ":").replace(")s", "")
-
             engine = self.get_db_engine(source)
 
-            with engine.connect() as connection:
-                result = connection.execute(text(query), params)
-            return result, 200
+            # Everything needed from the cursor is read before the connection goes back to the pool
+            with engine.begin() as connection:
+                result = connection.execute(_prepare(query), params)
+                rows = result.fetchall() if result.returns_rows else []
+                keys = list(result.keys()) if result.returns_rows else []
+                rowcount = result.rowcount
+            return {'rows': rows, 'keys': keys, 'rowcount': rowcount}, 200
         except Exception as e:
             print(traceback.format_exc(), str(e))
             return dict(), 400
@@ -86,23 +332,49 @@ class RawDatabase:
     # used for getting data from database (return: dataframe)
     def extract_data(self, query, **kwargs):
         try:
-            result, status = self.execute_query(query, **kwargs)
-            df = pd.DataFrame(result)
-            if len(df) == 0:
-                return pd.DataFrame(columns=result.keys()), status
-        
-            df.columns = result.keys()
-            return df, status
+            params = kwargs.get("params", {})
+            source = kwargs.get("source", None)
+            dtype_backend = kwargs.get("dtype_backend", DTYPE_BACKEND)
+
+            engine = self.get_db_engine(source)
+
+            # Columnar, Arrow backed (when available) frame read while the connection is open
+            with engine.connect() as connection:
+                df = pd.read_sql(_prepare(query), connection, params=params, dtype_backend=dtype_backend)
+
+            return df, 200
         except Exception as e:
             print(traceback.format_exc(), str(e))
-            return pd.DataFrame(), status
+            return pd.DataFrame(), 400
+
+    # used for getting large results from database in chunks (yields: dataframe)
+    def extract_data_chunks(self, query, chunksize=50000, **kwargs):
+        """
+        Yields the query result as DataFrames of at most `chunksize` rows.
+
+        The rows are read through a server side cursor, so only one chunk is held in memory at a time.
+        """
+        params = kwargs.get("params", {})
+        source = kwargs.get("source", None)
+        dtype_backend = kwargs.get("dtype_backend", DTYPE_BACKEND)
+
+        engine = self.get_db_engine(source)
+
+        with engine.connect() as connection:
+            connection = connection.execution_options(stream_results=True)
+            for chunk in pd.read_sql(_prepare(query), connection, params=params, chunksize=chunksize,
+                                     dtype_backend=dtype_backend):
+                yield chunk
 
     def _clean_data(self, data):
-        cleaned_data = data.where(pd.notnull(data), None)
-        cleaned_data = cleaned_data.replace({np.nan: None})
-        cleaned_data = cleaned_data.replace({'NaN': None})
+        cleaned_data = _replace_nulls(data)
+
+        # Only object columns can carry the literal string 'NaN'
+        obj_cols = cleaned_data.select_dtypes(include=['object']).columns
+        if len(obj_cols):
+            cleaned_data[obj_cols] = cleaned_data[obj_cols].replace({'NaN': None})
 
-        normalised_cloumns = [''.join(e for e in i if e.isalnum()) for i in cleaned_data.columns.to_list()]
+        normalised_cloumns = [_norm_col(c) for c in cleaned_data.columns.to_list()]
         cleaned_data.columns = normalised_cloumns
         return cleaned_data
     
@@ -110,90 +382,147 @@ class RawDatabase:
         try:
             engine = self.get_db_engine()
             all_columns = data.columns.tolist()
-            normalised_cloumns = [''.join(e for e in i if e.isalnum()) for i in all_columns]
 
-            # Preparing the SQL query with named parameters for bulk insert
-            columns_placeholder = ", ".join([f":{col}" for col in normalised_cloumns])
-            updateString = ",".join([f"`{i}` = values(`{i}`)" for i in all_columns])
-            updateString = updateString+ ",`record_updated` = current_timestamp()"
+            # One cached upsert statement per (table, columns), shared by every batch and call
+            stmt = _compile_upsert(table_name, tuple(all_columns))
 
-            sql_query = f"""
-                INSERT INTO {table_name} ({', '.join(["`"+col+"`" for col in all_columns])})
-                VALUES ({columns_placeholder})
-                ON DUPLICATE KEY UPDATE {updateString};
-            """
+            # cleaning null datas and renaming headers, skipped when the frame is already clean
+            obj_cols = data.select_dtypes(include=['object']).columns
+            needs_clean = (data.isna().to_numpy().any()
+                           or any(_norm_col(c) != c for c in all_columns)
+                           or (len(obj_cols) and (data[obj_cols] == 'NaN').to_numpy().any()))
+            cleaned_data = self._clean_data(data) if needs_clean else data
 
-            # cleaning null datas and renaming headers
-            cleaned_data = self._clean_data(data)
+            rowcount = 0
+            t1_start = perf_counter()
 
-            def chunker(seq, size):
-                return (seq[pos:pos + size] for pos in range(0, len(seq), size))
-        
-            # Convert DataFrame to a list of dictionaries
-            data_dicts = cleaned_data.to_dict('records')
+            if len(cleaned_data) > LOAD_DATA_THRESHOLD:
+                with _engine_for(self.database_uris, local_infile=True).begin() as conn:
+                    rowcount = self._load_data_infile(conn, cleaned_data, table_name, all_columns)
+                duration = perf_counter() - t1_start
+                return [rowcount, duration]
 
-            t1_start = perf_counter()
-            with engine.begin() as conn:
-                # Process data in batches
-                for batch in chunker(data_dicts, batch_size):
-                    # SQLAlchemy executes queries using transactions, so this is already optimized
-                    result = conn.execute(text(sql_query), batch)
+            # Batches are upserted in parallel, each on its own pooled connection. Workers never
+            # exceed the pool size and at most one batch per worker is built ahead of time.
+            workers = max(1, min(POOL_SIZE, -(-len(cleaned_data) // batch_size)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = set()
+                # Each batch is built on demand and released after it is executed
+                for batch in _iter_batches(cleaned_data, batch_size):
+                    if len(pending) >= workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        rowcount += sum(future.result() for future in done)
+                    pending.add(executor.submit(self._upsert_batch, engine, stmt, batch))
+                rowcount += sum(future.result() for future in pending)
             duration = perf_counter() - t1_start
-            return [result.rowcount, duration]
+            return [rowcount, duration]
         except SQLAlchemyError as se:
             print(str(se))
-            error_code = se.orig.args[0]
-            error_message = se.orig.args[1]
+            orig_args = getattr(getattr(se, 'orig', None), 'args', ()) or (None, '')
+            error_code = orig_args[0]
+            error_message = str(orig_args[-1])
 
             if error_code == 1146 and "doesn't exist" in error_message:
                 data['record_inserted'] = datetime.now()
                 data['record_updated'] = datetime.now()
-                data.to_sql(table_name, con=engine, if_exists='append', index=False)
+                # Multi-row INSERTs, 5000 rows per statement, instead of one statement per row
+                data.to_sql(table_name, con=engine, if_exists='append', index=False, method='multi', chunksize=5000)
             else:
-                pass
+                # Batches commit independently, so some may already be loaded. Never report success
+                raise
         except Exception as e:
             print(traceback.format_exc(), str(e))
             return [0,0]
 
+    def _upsert_batch(self, engine, stmt, batch):
+        """
+        Executes the upsert for one batch in its own transaction and returns the affected row count.
+        pymysql's executemany splits the batch into multi-row statements by max_stmt_length.
+
+        Concurrent upserts into one InnoDB table can deadlock, the batch is then rolled back and
+        retried up to DEADLOCK_RETRIES times before the error is raised.
+        """
+        for attempt in range(DEADLOCK_RETRIES):
+            try:
+                with engine.begin() as conn:
+                    result = conn.execute(stmt, batch)
+                return result.rowcount
+            except OperationalError as oe:
+                if getattr(oe.orig, 'args', (None,))[0] not in DEADLOCK_ERRORS or attempt == DEADLOCK_RETRIES - 1:
+                    raise
+                sleep(0.1 * (attempt + 1))
+
+    def _load_data_infile(self, conn, data, table_name, columns):
+        """
+        Bulk loads the cleaned DataFrame into a temporary staging table with LOAD DATA LOCAL INFILE,
+        then upserts the staged rows into the target table in a single INSERT ... SELECT.
+        """
+        target_table, staging_table, column_list, merge_sql = _build_bulk_merge_sql(table_name, tuple(columns))
+
+        data = data.copy()
+
+        # Bools are written as 1/0, LOAD DATA would store the text True/False as 0
+        for col in data.select_dtypes(include=['bool', 'boolean']).columns:
+            data[col] = data[col].astype('Int8')
+
+        for col in data.select_dtypes(include=['object', 'string']).columns:
+            series = data[col]
+            if pd.api.types.infer_dtype(series, skipna=True) == 'boolean':
+                data[col] = series.map({True: 1, False: 0}, na_action='ignore').astype('Int8')
+                continue
+            # Backslash is the LOAD DATA escape character, so literal ones are doubled
+            try:
+                escaped = series.str.replace('\\', '\\\\', regex=False)
+            except AttributeError:
+                continue
+            data[col] = escaped.where(escaped.notna(), series)
+
+        # The staging table copies the columns but not the keys, so LOCAL (which implies IGNORE)
+        # drops no duplicate rows. _stg_row keeps the file order for the merge.
+        conn.execute(text(f"CREATE TEMPORARY TABLE {staging_table} "
+                          f"(`_stg_row` BIGINT AUTO_INCREMENT PRIMARY KEY) "
+                          f"SELECT * FROM {target_table} LIMIT 0"))
+        try:
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.csv') as f:
+                data.to_csv(f, index=False, header=False, na_rep='\\N', lineterminator='\n')
+                f.flush()
+
+                conn.execute(text(f"""
+                    LOAD DATA LOCAL INFILE '{f.name}' INTO TABLE {staging_table}
+                    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+                    LINES TERMINATED BY '\\n' ({column_list});
+                """))
+
+            result = conn.execute(text(merge_sql))
+            return result.rowcount
+        finally:
+            conn.execute(text(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}"))
+
     def insert_df_table(self, df, table_name, primary_key=None):
         try:
             engine = self.get_db_engine()
         
-            # Replace NaN with None to handle NULL values in the database
-            df = df.where(pd.notnull(df), None)
-            df = df.applymap(lambda x: None if pd.isna(x) else x)
+            # Placeholder timestamps (Timestamp.min, epoch) are masked to NaT, in any datetime64 unit
+            dt_cols = df.select_dtypes(include=['datetime64']).columns
+            if len(dt_cols):
+                df = df.copy()
+                df[dt_cols] = df[dt_cols].mask(df[dt_cols].isin([pd.Timestamp.min, pd.Timestamp('1970-01-01 00:00:00')]))
 
-            for col in df.select_dtypes(include=['datetime64[ns]']).columns:
-                df[col] = df[col].apply(lambda x: None if pd.isna(x) or x == pd.Timestamp.min or x == pd.Timestamp('1970-01-01 00:00:00')  else x)
+            # Replace NaN/NaT with None to handle NULL values in the database, placeholders included
+            df = _replace_nulls(df)
 
             column_names = df.columns.tolist()
 
-            data_dict = df.to_dict(orient='records')
+            data_dict = list(_iter_records(df))
 
-            for i in range(len(data_dict)):
-                for j in data_dict[i].keys():
-                    if pd.isna(data_dict[i][j]):
+            # One cached insert (or upsert, when a primary key is given) per (table, columns)
+            stmt = _compile_insert(table_name, tuple(column_names), primary_key)
 
-                        data_dict[i][j] = None
-        
-            # Prepare the insert statement with parameter placeholders
-            insert_stmt = f"INSERT INTO {table_name} ("
-            insert_stmt += ", ".join([f"`{col}`" for col in column_names]) + ") VALUES "
-            insert_stmt += "(" + ", ".join([":{}".format(col) for col in column_names]) + ")"
-            
-            if primary_key:
-                insert_stmt += """ ON DUPLICATE KEY UPDATE """
-                update_stmt = ", ".join([f"`{col}` = VALUES(`{col}`)" for col in column_names if col != primary_key])
-                update_stmt += ", `record_updated` = current_timestamp()"
-                insert_stmt += update_stmt
-            
-            insert_stmt += ';'
-            
+            if not data_dict:
+                return
 
-            # print('insert_stmt: ', insert_stmt)
-            with engine.connect() as conn:
-                conn.execute(text(insert_stmt), data_dict)
-                conn.commit() 
+            with engine.begin() as conn:
+                conn.execute(stmt, data_dict)
                 
         except Exception as e:
             print(f"Error during upsert operation: {e}")
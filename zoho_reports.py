@@ -2,17 +2,67 @@ import os
 import sys
 import time
 import json
+import queue
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import traceback
 import numpy as np
 import pandas as pd
+from pandas import json_normalize
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from models import RawDatabase
 from dotenv import load_dotenv
 
+try:
+    # orjson parses the large report pages several times faster than the json module
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+try:
+    # Disk backed HTTP cache, unchanged report pages come back as 304 Not Modified
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
 load_dotenv()
 
+# Access token cached between runs, reused while it has more than TOKEN_REFRESH_MARGIN seconds left.
+TOKEN_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".zoho_token.json")
+TOKEN_REFRESH_MARGIN = 300
+
+# Attempts per report page when the request fails or the body can't be parsed, with exponential backoff.
+REQUEST_ATTEMPTS = 3
+REQUEST_BACKOFF = 0.5
+
+# Pages of a report fetched concurrently, kept low to respect the Zoho API rate limits.
+PAGE_FETCH_WORKERS = 10
+
+# Zoho requests in flight at once across all the reports running in parallel.
+MAX_CONCURRENT_REQUESTS = 10
+
+# Maximum pages fetched per report, 100k records at 500 per page. temp for stopping the infinite loop
+MAX_PAGES = 200
+
+# Fetched pages waiting to be processed while the next ones are being fetched.
+PREFETCH_PAGES = 2 * PAGE_FETCH_WORKERS
+
+# Records buffered before they are turned into a DataFrame and saved.
+CHUNK_ROWS = 10000
+
+# Report fields kept for each table, in table column order. Any other field is never loaded into the DataFrame.
+_CN_COLUMNS = ('creditnote_id', 'creditnote_number', 'status', 'date', 'customer_id', 'customer_name', 'exchange_rate', 'bcy_total', 'bcy_balance')
+_VC_COLUMNS = ('vendor_credit_id', 'vendor_credit_number', 'status', 'date', 'vendor_id', 'vendor_name', 'bcy_total', 'bcy_balance', 'currency_code')
+_AR_COLUMNS = ('entity_id', 'date', 'amount', 'exchange_rate', 'reminders_sent', 'currency_code', 'balance', 'transaction_number', 'customer_name', 'customer_id', 'entity', 'age', 'status')
+_AP_COLUMNS = ('id', 'date', 'amount', 'balance', 'transaction_number', 'vendor_id', 'vendor_name', 'currency_code', 'currency_id', 'entity', 'age', 'status', 'due_date')
+_GL_COLUMNS = ('date', 'account_name', 'transaction_details', 'transaction_id', 'offset_account_id', 'offset_account_type', 'transaction_type', 'reference_number', 'entity_number', 'debit', 'credit', 'account_id', 'currency_code', 'branch', 'account', 'net_amount')
+_AP_SELECT_COLUMNS = json.dumps([{"field": field, "group": "report"} for field in ('date', 'transaction_number', 'entity', 'status', 'vendor_name', 'age', 'amount', 'balance', 'due_date')], separators=(',', ':'))
+_GL_GROUP_COLUMNS = ('group_id', 'opening_debit', 'opening_credit', 'opening_date', 'closing_debit', 'closing_credit', 'closing_date')
+
 
 class ZohoReports:
 
@@ -35,7 +85,11 @@ class ZohoReports:
             The organization ID, fetched from environment variables.
             
         access_token : str
-            The access token needed for API requests, valid for 60 minutes. Generated using the get_zoho_books_access_token method.
+            The access token needed for API requests, valid for 60 minutes. Reused from TOKEN_CACHE_PATH while it is 
+            still valid, otherwise generated using the get_zoho_books_access_token method.
+
+        session : requests.Session
+            The pooled HTTP session shared by all Zoho requests, keeping connections alive between pages.
         """
         
         self.Client_ID = os.getenv('Client_ID')
@@ -47,11 +101,20 @@ class ZohoReports:
         # Batch id for uniquely identifying the records of the specific run.
         self.batch_id = datetime.now().strftime('%Y%m%d%H%M%S')
 
-        # Access token vaid for 60 min/1 hr. So process will be completed in one go
-        self.access_token = self.get_zoho_books_access_token()
-
         self.file_path = self.get_file_path()
 
+        self.session = self.get_session()
+
+        # Reports run in parallel, this caps the requests they send to Zoho at the same time
+        self.request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+        # Refreshing the token is serialized, the reports share it across threads
+        self.token_lock = threading.Lock()
+
+        # Access token vaid for 60 min/1 hr. Refreshed once if a request is rejected with 401
+        self.session.headers["Content-Type"] = "application/json"
+        self.set_access_token(self.get_cached_access_token() or self.get_zoho_books_access_token())
+
 
     def get_file_path(self):
         
@@ -62,12 +125,77 @@ class ZohoReports:
         return os.path.join(folder_path, 'temp.csv')
 
 
+    def get_session(self):
+        """
+        Creates the HTTP session used for all Zoho requests.
+
+        Connections are pooled and kept alive, so the TCP and TLS handshake is paid once per connection 
+        instead of once per request. The pool is large enough for the concurrent page fetches, and failed 
+        or rate limited requests are retried with backoff.
+
+        When requests-cache is installed, GET responses are also cached in a SQLite file next to the temp file. 
+        Every cached page is revalidated with its ETag / Last-Modified, so unchanged pages come back as 304 and 
+        are not downloaded again, while changed pages are always fresh. The token POST is never cached.
+
+        Returns:
+        -------
+        requests.Session
+            The session with the pooled, retrying adapter mounted for https.
+        """
+
+        if requests_cache is not None:
+            session = requests_cache.CachedSession(
+                cache_name=os.path.join(os.path.dirname(self.file_path), 'zoho_cache'),
+                backend='sqlite',
+                expire_after=0,
+                cache_control=True,
+                allowable_methods=('GET',)
+            )
+        else:
+            session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retries))
+        return session
+
+
+    def set_access_token(self, access_token):
+        self.access_token = access_token
+        self.session.headers["Authorization"] = f"Zoho-oauthtoken {access_token}"
+
+
+    def get_cached_access_token(self):
+        """
+        Returns the access token cached in TOKEN_CACHE_PATH, if it was issued for the same client and is valid 
+        for more than TOKEN_REFRESH_MARGIN seconds. Otherwise returns None.
+        """
+        try:
+            with open(TOKEN_CACHE_PATH) as f:
+                cached = json.load(f)
+
+            if cached["client_id"] == self.Client_ID and cached["expires_at"] - time.time() > TOKEN_REFRESH_MARGIN:
+                return cached["access_token"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+
+    def refresh_access_token(self, rejected_token):
+        """
+        Replaces an access token rejected by Zoho with a new one. If another thread has already refreshed it, 
+        the new token is kept and no extra OAuth request is made.
+        """
+        with self.token_lock:
+            if self.access_token == rejected_token:
+                self.set_access_token(self.get_zoho_books_access_token())
+
+
     def get_zoho_books_access_token(self):
         """
         Retrieves an access token for authenticating Zoho API requests.
 
         This function sends a POST request to Zoho's OAuth endpoint with client credentials and a refresh token to obtain 
-        a new access token. The access token is required for calling the Zoho Reports API.
+        a new access token. The access token is required for calling the Zoho Reports API. The new token and its 
+        expiry are written to TOKEN_CACHE_PATH, so the next runs within the hour can reuse it.
 
         Returns:
         -------
@@ -82,9 +210,23 @@ class ZohoReports:
             "refresh_token": self.REFRESH_TOKEN,
             "grant_type": "refresh_token"
         }
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
+        response.raise_for_status()
 
         token_data = response.json()  
+
+        try:
+            # Readable by the current user only
+            fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({
+                    "client_id": self.Client_ID,
+                    "access_token": token_data["access_token"],
+                    "expires_at": time.time() + token_data.get("expires_in", 3600)
+                }, f)
+        except OSError as e:
+            print(f"Could not cache the access token: {str(e)}")
+
         return token_data["access_token"]
 
 
@@ -94,7 +236,7 @@ class ZohoReports:
 
         This function sends a GET request to the Zoho Books API to obtain data for a specific report. 
         If a custom URL is not provided, it constructs the URL using the report name. The organization's ID is included 
-        in the request parameters. An access token is used for authorization.
+        in the request parameters. The session carries the access token used for authorization.
 
         Parameters:
         ----------
@@ -102,7 +244,7 @@ class ZohoReports:
             The name of the report to retrieve data for.
         
         params : dict, optional
-            Additional parameters for the API request. If not provided, defaults to {"organization_id": self.organization_id}.
+            Additional parameters for the API request. It is not modified, the organization ID is added to a copy.
             
         url : str, optional
             The custom URL to use for the API request. If not provided, the function constructs a URL using the report name.
@@ -114,28 +256,217 @@ class ZohoReports:
         """
         if url is None:
             url = f"https://www.zohoapis.in/books/v3/reports/{report_name}/"
+
+        params = {**(params or {}), "organization_id": self.organization_id}
         
-        headers = {
-            "Authorization": f"Zoho-oauthtoken {self.access_token}",
-            "Content-Type": "application/json"
-        }
-        if params:
-            params['organization_id'] = self.organization_id
-        else:
-            params = {
-                "organization_id": self.organization_id
-            }
-        
-        response = requests.get(url, headers=headers, params=params)
+        # Transient failures (dropped connection, truncated body) are retried so a page is never silently lost.
+        # An HTTP error status is raised straight away for get_reports to log.
+        for attempt in range(REQUEST_ATTEMPTS):
+            try:
+                access_token = self.access_token
+                with self.request_slots:
+                    response = self.session.get(url, params=params)
+
+                # Expired or revoked token, refreshing it once and retrying
+                if response.status_code == 401:
+                    self.refresh_access_token(access_token)
+                    with self.request_slots:
+                        response = self.session.get(url, params=params)
+
+                if response.status_code == 200:
+                    # print("Success:", response.json())
+                    pass
+                else:
+                    print("Failed with status code:", response.status_code)
+                    print(response.text)
+                    response.raise_for_status()
+
+                return json_loads(response.content)
+
+            except (requests.HTTPError, requests.exceptions.RetryError):
+                # 429/5xx were already retried by the session adapter, retrying again would only add load
+                raise
+            except (requests.RequestException, ValueError) as e:
+                if attempt == REQUEST_ATTEMPTS - 1:
+                    raise
+                print(f"Retrying {report_name} page {params.get('page')} after error: {str(e)}")
+                time.sleep(REQUEST_BACKOFF * 2 ** attempt)
+
+
+    def _downcast(self, df):
+        """
+        Reduces the memory used by a report DataFrame before it is saved.
+
+        Object columns where less than half of the values are distinct (status, type, currency, names...) 
+        become categoricals, and integer columns are downcast to the smallest integer type. Floats are 
+        kept as float64 so amounts stay exact.
+        """
+        dtypes = {}
+        for column in df.select_dtypes(include='object').columns:
+            try:
+                if df[column].nunique() < len(df) * 0.5:
+                    dtypes[column] = 'category'
+            except TypeError:
+                # Unhashable values such as nested dicts can't be categorical
+                continue
 
-        if response.status_code == 200:
-            # print("Success:", response.json())
+        for column in df.select_dtypes(include='integer').columns:
+            dtypes[column] = pd.to_numeric(df[column], downcast='integer').dtype
+
+        return df.astype(dtypes)
+
+
+    def _has_more_page(self, data):
+        return bool((data.get('page_context') or {}).get('has_more_page'))
+
+
+    def _total_pages(self, data):
+        """
+        Returns the number of pages of the report when `page_context` gives it (total_pages, or total and 
+        per_page), otherwise None.
+        """
+        page_context = data.get('page_context') or {}
+        try:
+            if page_context.get('total_pages'):
+                return int(page_context['total_pages'])
+            if page_context.get('total') and page_context.get('per_page'):
+                return -(-int(page_context['total']) // int(page_context['per_page']))
+        except (TypeError, ValueError):
             pass
-        else:
-            print("Failed with status code:", response.status_code)
-            print(response.text)
+        return None
+
+
+    def get_zoho_books_report_pages(self, report_name, params, max_pages=MAX_PAGES):
+        """
+        Yields every page of a paginated report from the Zoho Books API, fetching pages concurrently.
 
-        return response.json()
+        The first page is fetched on its own to check `page_context`. While more pages are available, the next 
+        pages are requested at the same time, at most `PAGE_FETCH_WORKERS` per window. When `page_context` gives 
+        the total, each window stops at the last page. Otherwise windows start at one page and double, so only 
+        a few pages past the end are ever requested.
+
+        Parameters:
+        ----------
+        report_name : str
+            The name of the report to retrieve data for.
+
+        params : dict
+            The request parameters, including the starting "page". It is not modified.
+
+        max_pages : int, optional
+            The maximum number of pages to fetch. Defaults to MAX_PAGES.
+
+        Yields:
+        -------
+        dict
+            The JSON response of each fetched page, in page order.
+        """
+        page = params.get('page', 1)
+        last_page = page + max_pages - 1
+
+        data = self.get_zoho_books_report(report_name, params)
+        yield data
+
+        window_size = 1
+        with ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS) as executor:
+            while self._has_more_page(data) and page < last_page:
+                total_pages = self._total_pages(data)
+                if total_pages and total_pages > page:
+                    end = min(total_pages, page + PAGE_FETCH_WORKERS, last_page)
+                else:
+                    end = min(page + window_size, last_page)
+                    window_size = min(window_size * 2, PAGE_FETCH_WORKERS)
+                window = range(page + 1, end + 1)
+                futures = [executor.submit(self.get_zoho_books_report, report_name, {**params, "page": p}) for p in window]
+
+                for future in futures:
+                    data = future.result()
+                    yield data
+                    if not self._has_more_page(data):
+                        break
+
+                page = window[-1]
+
+
+    def _prefetch(self, pages, size=PREFETCH_PAGES):
+        """
+        Runs the page iterator in a background thread and yields its pages, so the next pages are fetched while 
+        the current ones are turned into DataFrames and saved. At most `size` fetched pages wait in the queue. 
+        An error raised while fetching is raised again here, in the consumer.
+        """
+        buffer = queue.Queue(maxsize=size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # Gives up once the consumer has stopped, so the producer never blocks forever
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for page in pages:
+                    if not put((page, None)):
+                        return
+            except Exception as e:
+                put((None, e))
+                return
+            put((done, None))
+
+        threading.Thread(target=produce, daemon=True).start()
+
+        try:
+            while True:
+                page, error = buffer.get()
+                if error is not None:
+                    raise error
+                if page is done:
+                    break
+                yield page
+        finally:
+            stop.set()
+
+
+    def iter_report_chunks(self, report_name, params, get_records, keep, chunk_rows=CHUNK_ROWS):
+        """
+        Yields the records of a paginated report in chunks, so a report never has to be held in memory at once.
+
+        Parameters:
+        ----------
+        report_name : str
+            The name of the report to retrieve data for.
+
+        params : dict
+            The request parameters, including the starting "page".
+
+        get_records : callable
+            Takes the JSON response of one page and returns the list of records in it.
+
+        keep : tuple
+            The record fields to keep. Other fields are dropped as the pages come in and never reach pandas.
+
+        chunk_rows : int, optional
+            The minimum number of records in each chunk, except the last one. Defaults to CHUNK_ROWS.
+
+        Yields:
+        -------
+        list
+            The records of consecutive pages, at least `chunk_rows` of them.
+        """
+        chunk = []
+        for data in self._prefetch(self.get_zoho_books_report_pages(report_name, params)):
+            chunk.extend({k: r[k] for k in keep if k in r} for r in get_records(data))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
 
 
     def creditNoteDetailsReport(self):
@@ -152,53 +483,28 @@ class ZohoReports:
         - Pagination is handled by incrementing the page number if the response indicates more pages are available. 
         The function stops fetching pages when the "has_more_page" attribute is False or when it reaches a limit of 200 pages.
         - Specific columns are renamed in the DataFrame to enhance readability before database insertion.
-        - Unnecessary columns, such as "currency_code," "sales_person_id," and others, are dropped from the DataFrame before insertion.
+        - Only the fields in `_CN_COLUMNS` are loaded into the DataFrame, unnecessary ones such as "currency_code," "sales_person_id," and others are never materialized.
+        - Records are processed and saved in chunks of `CHUNK_ROWS`.
         """
 
         report_name = "creditnotedetails"
 
-        data = self.get_zoho_books_report(report_name)
-
-        # results = []
-        # results.extend(data['creditnote_details'][0]['creditnotes'])
-
-        results = []
-        
         params = {
             "page": 1,
+            "per_page": 500,
         }
 
-        i = 0
-        while True:
-            data = self.get_zoho_books_report(report_name, params)
-            results.extend(data['creditnote_details'][0]['creditnotes'])
-            
-            # If more than one page so keep gooing until last
-            try:
-                if data['page_context']['has_more_page']:
-                    params['page'] += 1
-                else:
-                    break
-            except:
-                break
-
-            i += 1
-
-            # If records are more than 100k so stop. temp for stopping the infinite loop
-            if i == 200:
-                break
-
-
-        df = pd.DataFrame(results)
-        df = df.rename(columns={'date': 'credit_date', 'bcy_total': 'credit_note_amount', 'bcy_balance': 'balance_amount', 'creditnote_id': 'credit_note_id', 'creditnote_number': 'credit_note_number'})
-        df = df.drop(['currency_code', 'sales_person_id', 'associated_projects', 'project_names', 'contact', 'invoice', 'branch', 'reference_number', 'txn_posting_date'], axis = 1)
+        db = RawDatabase()
 
-        df['batch_id'] = self.batch_id
+        for results in self.iter_report_chunks(report_name, params, lambda data: data['creditnote_details'][0]['creditnotes'], _CN_COLUMNS):
+            df = pd.DataFrame.from_records(results, columns=_CN_COLUMNS)
+            df = df.rename(columns={'date': 'credit_date', 'bcy_total': 'credit_note_amount', 'bcy_balance': 'balance_amount', 'creditnote_id': 'credit_note_id', 'creditnote_number': 'credit_note_number'})
 
-        db = RawDatabase()
+            df['batch_id'] = self.batch_id
+            df = self._downcast(df)
 
-        # db.insert_df_table(df, "credit_note_details", "credit_note_id")
-        db.insert_df_table(df, "credit_note_details")
+            # db.insert_df_table(df, "credit_note_details", "credit_note_id")
+            db.insert_df_table(df, "credit_note_details")
 
 
     def vendorCreditDetails(self):
@@ -215,47 +521,30 @@ class ZohoReports:
         - The function stops fetching additional pages if the "has_more_page" attribute in the response indicates 
         there are no more pages or if it reaches a page limit (200).
         - Column names in the DataFrame are renamed for better readability before inserting into the database.
-        - Unnecessary columns, such as "currency_id," "vendor," and others, are dropped prior to database insertion.
+        - Only the fields in `_VC_COLUMNS` are loaded into the DataFrame, unnecessary ones such as "currency_id," "vendor," and others are never materialized.
+        - Records are processed and saved in chunks of `CHUNK_ROWS`.
         """
 
         report_name = "vendorcreditdetails"
 
         params = {
             "page": 1,
+            "per_page": 500,
             "usestate": "true",
             "response_option": 1
             }
 
-        results = []
-        i = 0
-        while True:
-            data = self.get_zoho_books_report(report_name, params)
-            results.extend(data['vendor_credit_details'][0]['vendor_credits'])
-            
-            # If more than one page so keep gooing until last
-            try:
-                if data['page_context']['has_more_page']:
-                    params['page'] += 1
-                else:
-                    break
-            except:
-                break
-
-            i += 1
-
-            # If records are more than 100k so stop. temp for stopping the infinite loop
-            if i == 200:
-                break
+        db = RawDatabase()
 
-        df = pd.DataFrame(results)
+        for results in self.iter_report_chunks(report_name, params, lambda data: data['vendor_credit_details'][0]['vendor_credits'], _VC_COLUMNS):
+            df = pd.DataFrame.from_records(results, columns=_VC_COLUMNS)
 
-        df = df.rename(columns= {"vendor_credit_number": "credit_note", "date": "vendor_credit_date", "bcy_total": "amount", "bcy_balance": "balance_amount"})
-        df = df.drop(['currency_id', "vendor", "has_attachment", "branch", "txn_posting_date", "reference_number"], axis = 1)
+            df = df.rename(columns= {"vendor_credit_number": "credit_note", "date": "vendor_credit_date", "bcy_total": "amount", "bcy_balance": "balance_amount"})
 
-        df['batch_id'] = self.batch_id
-        db = RawDatabase()
-        # db.insert_df_table(df, "vendor_credit_details", "vendor_credit_id")
-        db.insert_df_table(df, "vendor_credit_details")
+            df['batch_id'] = self.batch_id
+            df = self._downcast(df)
+            # db.insert_df_table(df, "vendor_credit_details", "vendor_credit_id")
+            db.insert_df_table(df, "vendor_credit_details")
 
 
     def arAgingDetails(self):
@@ -271,11 +560,10 @@ class ZohoReports:
         ------
         - The function continues to request additional pages until all pages are retrieved or a maximum of 
         200 pages (to avoid potential infinite loops).
-        - After fetching, the data is transformed into a DataFrame, certain columns are renamed, and 
-        unnecessary columns are removed.
+        - After fetching, the fields in `_AR_COLUMNS` are loaded into a DataFrame and certain columns are renamed.
         - Missing values in the 'age' column for certain dates are filled with specified values.
         - The cleaned DataFrame is then inserted into the "ar_aging_details" table in the database using 
-        the `RawDatabase` class.
+        the `RawDatabase` class, one chunk of `CHUNK_ROWS` records at a time.
         """
         
         report_name = "aragingdetails"
@@ -295,42 +583,23 @@ class ZohoReports:
             "response_option": 1
         }
 
-        results = []
-        i = 0
-        while True:
-            # calling for data once
-            data = self.get_zoho_books_report(report_name, params)
-            results.extend(data['invoiceaging'][0]['invoiceaging'])
-
-            # If more than one page so keep gooing until last
-            if data['page_context']['has_more_page']:
-                params['page'] += 1
-            else:
-                break
-            
-            i += 1
-
-            # If records are more than 100k so stop. temp for stopping the infinite loop
-            if i == 200:
-                break
+        db = RawDatabase()
 
-        df = pd.DataFrame(results)
-        df = df.rename(columns={"entity": "type", 'balance': 'balance_due'})
-        df = df.drop(["payment_expected_date", "contact"], axis = 1)
+        for results in self.iter_report_chunks(report_name, params, lambda data: data['invoiceaging'][0]['invoiceaging'], _AR_COLUMNS):
+            df = pd.DataFrame.from_records(results, columns=_AR_COLUMNS)
+            df = df.rename(columns={"entity": "type", 'balance': 'balance_due'})
 
-        # There are some empty value in age so for them replacing the value
-        df.loc[df['date'] == "2020-03-31", 'age'] = 1653
-        
-        df['age'] = df['age'].apply(lambda x: 0 if x == '' else x)
+            # There are some empty value in age so for them replacing the value
+            df['age'] = df['age'].mask(df['date'].eq('2020-03-31'), 1653)
+            
+            df['age'] = pd.to_numeric(df['age'].mask(df['age'].eq('')), errors='coerce').fillna(0).astype('int32')
 
-        df = df[["entity_id", "date", "amount", "exchange_rate", "reminders_sent", "currency_code", "balance_due", "transaction_number", "customer_name", "customer_id", "type", "age", "status"]]
 
+            df['batch_id'] = self.batch_id
+            df = self._downcast(df)
 
-        df['batch_id'] = self.batch_id
-        db = RawDatabase()
-
-        # db.insert_df_table(df, "ar_aging_details", "entity_id")
-        db.insert_df_table(df, "ar_aging_details")
+            # db.insert_df_table(df, "ar_aging_details", "entity_id")
+            db.insert_df_table(df, "ar_aging_details")
 
 
     def apAgingDetails(self):
@@ -349,6 +618,7 @@ class ZohoReports:
         ------
         - The function temporarily limits retrieval to 200 pages to prevent infinite loops if excessive records are encountered.
         - The column `age` is set to 1653 for records where the date is "2020-03-31".
+        - Records are processed and saved in chunks of `CHUNK_ROWS`.
         """
 
         report_name = "apagingdetails"
@@ -365,37 +635,22 @@ class ZohoReports:
             "interval_type": "days",
             "group_by": "none",
             "include_vendor_credit_notes": "false",
-            "select_columns": '[{"field":"date","group":"report"},{"field":"transaction_number","group":"report"},{"field":"entity","group":"report"},{"field":"status","group":"report"},{"field":"vendor_name","group":"report"},{"field":"age","group":"report"},{"field":"amount","group":"report"},{"field":"balance","group":"report"},{"field":"due_date","group":"report"}]',
+            "select_columns": _AP_SELECT_COLUMNS,
             "include_manual_journals": "false",
             "response_option": 1      
         }
 
-        results = []
-        i = 0
-        while True:
-            # calling for data once
-            data = self.get_zoho_books_report(report_name, params)
-            results.extend(data['billsaging']['group_list'][0]['group_list'][0]['group_list'])
-            
-            # If more than one page so keep gooing until last
-            if data['page_context']['has_more_page']:
-                params['page'] += 1
-            else:
-                break
-            
-            i += 1
-
-            # If records are more than 100k so stop. temp for stopping the infinite loop
-            if i == 200:
-                break
+        db = RawDatabase()
 
-        df = pd.DataFrame(results)
-        df = df.rename(columns= {"amount": "bill_amount", "balance": "balance_due", "id": "ap_aging_id", "entity": "type"})
-        df.loc[df['date'] == "2020-03-31", "age"] = 1653
+        for results in self.iter_report_chunks(report_name, params, lambda data: data['billsaging']['group_list'][0]['group_list'][0]['group_list'], _AP_COLUMNS):
+            df = pd.DataFrame.from_records(results, columns=_AP_COLUMNS)
+            df = df.rename(columns= {"amount": "bill_amount", "balance": "balance_due", "id": "ap_aging_id", "entity": "type"})
+            df['age'] = df['age'].mask(df['date'].eq('2020-03-31'), 1653)
+            df['age'] = pd.to_numeric(df['age'].mask(df['age'].eq('')), errors='coerce').fillna(0).astype('int32')
 
-        df['batch_id'] = self.batch_id
-        db = RawDatabase()
-        db.insert_df_table(df, "ap_aging_details", "ap_aging_id")
+            df['batch_id'] = self.batch_id
+            df = self._downcast(df)
+            db.insert_df_table(df, "ap_aging_details", "ap_aging_id")
 
 
     def generalLedgerDetails(self):
@@ -415,7 +670,8 @@ class ZohoReports:
         summaries are stored in a separate list.
         - Specific columns are reformatted and renamed in the DataFrames to enhance readability and match the database schema 
         before insertion.
-        - Unnecessary columns, such as "branch," "project_ids," "account," and "net_amount," are dropped from the "general_ledger_details" DataFrame before insertion.
+        - Nested "branch" and "account" fields are flattened and only the "general_ledger_details" table columns are kept before insertion.
+        - Pages are saved every `CHUNK_ROWS` transactions, so the whole ledger is never held in memory.
         - Dates in the "general_ledger_groups" DataFrame are formatted to remove prefixes and numeric columns are converted to 
         floats for accurate storage and computation.
         """
@@ -424,109 +680,99 @@ class ZohoReports:
 
         params = {
             "page": 1,
+            "per_page": 500,
             "usestate": "true",
             "response_option": 0,
             }
 
+        db = RawDatabase()
 
         results = []
         group = []
-        i = 0
-        while True:
-            # calling for data once
-            data = self.get_zoho_books_report(report_name, params)
-
-            for j in range(len(data['account_transactions'])):
+        for data in self._prefetch(self.get_zoho_books_report_pages(report_name, params)):
 
-                if "account_transactions" in data['account_transactions'][j]:
+            for acct in data['account_transactions']:
+                gname = acct['group_name']
 
-                    # results.extend(data['account_transactions'][j]['account_transactions'])
+                if "account_transactions" in acct:
+                    results.extend(dict(((k, t[k]) for k in _GL_COLUMNS if k in t), group_id=gname) for t in acct['account_transactions'])
 
-                    for k in range(len(data['account_transactions'][j]['account_transactions'])):
+                ob, cb = acct['opening_balance'], acct['closing_balance']
+                group.append({'group_id': gname,
+                              'opening_debit': ob['debit'], 'opening_credit': ob['credit'], 'opening_date': ob['date'],
+                              'closing_debit': cb['debit'], 'closing_credit': cb['credit'], 'closing_date': cb['date']})
 
-                        temp = data['account_transactions'][j]['account_transactions'][k] 
-                        temp['group_id'] = data['account_transactions'][j]['group_name']
+            # Saving in chunks so the whole ledger is never held in memory
+            if len(results) >= CHUNK_ROWS:
+                self._save_general_ledger_groups(db, group)
+                self._save_general_ledger_details(db, results)
+                results = []
+                group = []
 
-                        results.append(temp)
+        if group:
+            self._save_general_ledger_groups(db, group)
+        if results:
+            self._save_general_ledger_details(db, results)
 
-                temp_d = {}
-
-                temp_d['group_id'] = data['account_transactions'][j]['group_name']
-                temp_d['opening_debit'] = data['account_transactions'][j]['opening_balance']['debit']
-                temp_d['opening_credit'] = data['account_transactions'][j]['opening_balance']['credit']
-                temp_d['opening_date'] = data['account_transactions'][j]['opening_balance']['date']
-
-                temp_d['closing_debit'] = data['account_transactions'][j]['closing_balance']['debit']
-                temp_d['closing_credit'] = data['account_transactions'][j]['closing_balance']['credit']
-                temp_d['closing_date'] = data['account_transactions'][j]['closing_balance']['date']
-
-                group.append(temp_d)
-            
-            # If more than one page so keep gooing until last
-            if data['page_context']['has_more_page']:
-                params['page'] += 1
-            else:
-                break
-            
-            i += 1
 
-            # If records are more than 100k so stop. temp for stopping the infinite loop
-            if i == 200:
-                break
+    def _save_general_ledger_groups(self, db, group):
+        """
+        Formats the account group summaries of the general ledger and saves them to the "general_ledger_groups" table.
+        """
 
         # general_ledger_groups
-        df1 = pd.DataFrame(group)
+        df1 = pd.DataFrame.from_records(group, columns=_GL_GROUP_COLUMNS)
 
-        df1['opening_date'] = df1['opening_date'].apply(lambda x: x[6:] if x.startswith('As On') else x)
-        df1['closing_date'] = df1['closing_date'].apply(lambda x: x[6:] if x.startswith('As On') else x)
+        # Dropping the "As On " prefix of the dates
+        for column in ['opening_date', 'closing_date']:
+            df1[column] = np.where(df1[column].str.startswith('As On'), df1[column].str[6:], df1[column])
 
         df1["opening_date"] = pd.to_datetime(df1["opening_date"], format="%d-%m-%y").dt.strftime("%y/%m/%d")
         df1["closing_date"] = pd.to_datetime(df1["closing_date"], format="%d-%m-%y").dt.strftime("%y/%m/%d")
 
         for column in ['opening_debit', 'opening_credit', 'closing_debit', 'closing_credit']:
-            df1[column] = df1[column].replace("", "0.00") 
-            df1[column] = df1[column].str.replace(",", "")
-            df1[column] = df1[column].astype(float)  
+            df1[column] = df1[column].replace("", "0.00").str.replace(",", "", regex=False).astype(float)
 
         df1['batch_id'] = self.batch_id
+        df1 = self._downcast(df1)
 
-        # df1.to_csv("temp/temp.csv", index = False)
-        # df1 = pd.read_csv("temp/temp.csv")
-        df1.to_csv(self.file_path, index = False)
-        df1 = pd.read_csv(self.file_path)
-
-        db = RawDatabase()
         # db.insert_df_table(df1, "general_ledger_groups", "group_id")
         db.insert_df_table(df1, "general_ledger_groups")
 
 
-        # general_ledger_details
-        df = pd.DataFrame(results)
+    def _save_general_ledger_details(self, db, results):
+        """
+        Formats the transactions of the general ledger and saves them to the "general_ledger_details" table.
+        """
 
-        df['branch_name'] = df['branch'].apply(lambda x: x['branch_name'])
-        df['account_group'] = df['account'].apply(lambda x: x['account_group'])
+        # general_ledger_details
+        # Nested "branch" and "account" are flattened to branch_* and account_* columns
+        df = json_normalize(results, sep='_', max_level=1)
+        df = df.rename(columns = {"branch_branch_name": "branch_name", "account_account_group": "account_group"})
 
-        df['amount'] = df['net_amount'].apply(lambda x: x.split(' ')[0])
-        df['currency'] = df['net_amount'].apply(lambda x: x.split(' ')[1] if len(x.split(' '))>1 else x)
+        # net_amount is "<amount> <currency>", without a currency the whole value is kept as currency
+        net_amount = df['net_amount'].str.split(' ', n=2, expand=True)
+        df['amount'] = net_amount[0]
+        df['currency'] = net_amount[1].fillna(df['net_amount']) if 1 in net_amount.columns else df['net_amount']
 
         # df['batch_id'] = datetime.now().strftime('%Y%m%d%H%M%S')
 
-        df = df.drop(['branch', 'project_ids', 'account', 'reference_transaction_id', 'reporting_tag', 'net_amount','contact_id'], axis = 1)
-
         df = df.rename(columns = {"account_name": "account", "entity_number": "transaction_number"})
 
+        # Keeping only the table columns, this also drops the rest of the flattened branch/account fields
+        df = df[["date", "account", "transaction_details", "transaction_id", "offset_account_id", "offset_account_type", "transaction_type", "reference_number", "transaction_number", "debit", "credit", "account_id", "currency_code", "group_id", "branch_name", "account_group", "amount", "currency"]]
+
         for column in ['amount', 'debit', 'credit']:
             df[column] = df[column].replace("", "0.00") 
             if column == 'amount':
-                df[column] = df[column].str.replace(",", "")
+                df[column] = df[column].str.replace(",", "", regex=False)
             df[column] = df[column].astype(float)  
 
         df['batch_id'] = self.batch_id
 
-        df.to_csv(self.file_path, index = False)
-        df = pd.read_csv(self.file_path)
-        
-        db = RawDatabase()
+        # Empty strings are stored as NULL
+        df = df.mask(df.eq(""))
+        df = self._downcast(df)
         db.insert_df_table(df, "general_ledger_details")
 
 
@@ -534,7 +780,7 @@ class ZohoReports:
         """
         Retrieves multiple reports from the Zoho Books API and processes each report individually.
 
-        This function iterates over a predefined list of report names, calling specific functions to fetch and 
+        This function runs over a predefined set of report names, calling specific functions to fetch and 
         process each report's data. For each report, the corresponding function is executed to retrieve data 
         and store it in the database. If an error occurs during any report retrieval or processing, an error 
         message and stack trace are printed.
@@ -547,34 +793,31 @@ class ZohoReports:
         - `aragingdetails` calls `arAgingDetails`
         - `apagingdetails` calls `apAgingDetails`
         - `generalledgerdetails` calls `generalLedgerDetails`
+        - The reports are independent, so they run in parallel in a thread pool and each one opens its own 
+        `RawDatabase`. Total time is about the slowest report instead of the sum of all of them.
         - Any exceptions encountered during the process are caught, with error details and traceback printed for debugging.
         """
-        
-
-        reports_list = ["creditnotedetails", "vendorcreditdetails", "aragingdetails", "apagingdetails", "generalledgerdetails"]
-
-        for report_name in reports_list:
-            try:
-                if report_name == "creditnotedetails":
-                    self.creditNoteDetailsReport()
-
-                elif report_name == "vendorcreditdetails":
-                    self.vendorCreditDetails()
 
-                elif report_name == "aragingdetails":
-                    self.arAgingDetails()
-
-                elif report_name == "apagingdetails":
-                    self.apAgingDetails()
-
-                elif report_name == "generalledgerdetails":
-                    self.generalLedgerDetails()        
+        report_functions = {
+            "creditnotedetails": self.creditNoteDetailsReport,
+            "vendorcreditdetails": self.vendorCreditDetails,
+            "aragingdetails": self.arAgingDetails,
+            "apagingdetails": self.apAgingDetails,
+            "generalledgerdetails": self.generalLedgerDetails,
+        }
 
-                print(f"{report_name}  -- Done")
-            
-            except Exception as e:
-                print(f"Error while fetching {report_name}: {str(e)}")
-                print(traceback.format_exc())
+        with ThreadPoolExecutor(max_workers=len(report_functions)) as executor:
+            futures = {executor.submit(function): report_name for report_name, function in report_functions.items()}
+
+            for future in as_completed(futures):
+                report_name = futures[future]
+                try:
+                    future.result()
+                    print(f"{report_name}  -- Done")
+                
+                except Exception as e:
+                    print(f"Error while fetching {report_name}: {str(e)}")
+                    print(traceback.format_exc())
 
             
 if __name__ == "__main__":